@@ -5,11 +5,16 @@ Stores and retrieves Q&A pairs with embeddings for semantic search.
 
 import json
 import sqlite3
+import threading
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
 from dataclasses import dataclass
 from pathlib import Path
 
 import numpy as np
 
+from text_tokens import significant_words
+
 
 @dataclass
 class StoredQA:
@@ -18,38 +23,195 @@ class StoredQA:
     answer: str
     source_file: str
     category: str
-    embedding: list[float] | None = None
+    embedding: np.ndarray | None = None
+
+
+def _embedding_blob(embedding: list[float] | np.ndarray | None) -> bytes | None:
+    """Pack an embedding as raw float32 bytes, or None if there is none."""
+    if embedding is None or len(embedding) == 0:
+        return None
+    return np.ascontiguousarray(embedding, dtype=np.float32).tobytes()
+
+
+def _normalize_question(question: str) -> str:
+    """Normalize question text for exact lookups."""
+    return question.strip().lower()
+
+
+def _stored_qa(row: tuple) -> StoredQA:
+    """Build a StoredQA from an (id, question, answer, source_file, category, embedding_blob) row."""
+    return StoredQA(
+        id=row[0],
+        question=row[1],
+        answer=row[2],
+        source_file=row[3],
+        category=row[4],
+        embedding=np.frombuffer(row[5], dtype=np.float32) if row[5] else None,
+    )
 
 
 class KnowledgeBase:
-    def __init__(self, db_path: str = "data/knowledge.db"):
+    def __init__(
+        self,
+        db_path: str = "data/knowledge.db",
+        embedder: Callable[[list[str]], list] | None = None,
+        embedding_version: int = 0,
+    ):
+        """
+        Open the knowledge base, creating or migrating it as needed.
+        Given an embedder (question texts to vectors), stored vectors built
+        with a different embedding_version are regenerated on open.
+        """
         self.db_path = db_path
         Path(db_path).parent.mkdir(parents=True, exist_ok=True)
-        self._init_db()
 
-    def _init_db(self):
+        # One connection serves every call. It runs in autocommit mode, so
+        # reads need no bookkeeping and writes go through _transaction().
+        self._conn = sqlite3.connect(
+            db_path, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA cache_size=-65536")
+        self._conn.execute("PRAGMA mmap_size=268435456")
+        self._conn.execute("PRAGMA temp_store=MEMORY")
+        # Serializes writes and guards the in-memory search index below.
+        # Reentrant, so index maintenance can run inside a transaction.
+        self._lock = threading.RLock()
+
+        self._init_db(embedder, embedding_version)
+
+        # Incremented on every write so callers can invalidate derived caches
+        self.version = 0
+
+        # In-memory search index over stored embeddings, built on first search.
+        # Rows are L2-normalized and line up with the entries of _emb_rows.
+        self._emb_matrix: np.ndarray | None = None
+        self._emb_rows: list[StoredQA] = []
+
+    @contextmanager
+    def _transaction(self, immediate: bool = False) -> Iterator[sqlite3.Cursor]:
+        """
+        Run the enclosed statements as one transaction on the shared connection.
+        An immediate transaction takes the database write lock up front, so
+        other processes cannot change what it reads before it writes.
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            yield cursor
+
+    def close(self):
+        """Close the database connection."""
+        self._conn.close()
+
+    def _init_db(self, embedder: Callable[[list[str]], list] | None, embedding_version: int):
         """Initialize the SQLite database."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        # Immediate, so concurrent workers opening the database migrate it once
+        with self._transaction(immediate=True) as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS qa_pairs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    question TEXT NOT NULL,
+                    answer TEXT NOT NULL,
+                    source_file TEXT,
+                    category TEXT,
+                    embedding TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_source_file ON qa_pairs(source_file)
+            """)
+
+            # Older databases hold embeddings as JSON text in the embedding
+            # column; move them into the float32 column once and drop the text
+            cursor.execute("PRAGMA table_info(qa_pairs)")
+            columns = {row[1] for row in cursor.fetchall()}
+            if "embedding_blob" not in columns:
+                cursor.execute("ALTER TABLE qa_pairs ADD COLUMN embedding_blob BLOB")
+
+            cursor.execute("SELECT id, embedding FROM qa_pairs WHERE embedding IS NOT NULL")
+            legacy = cursor.fetchall()
+            cursor.executemany(
+                "UPDATE qa_pairs SET embedding_blob = ?, embedding = NULL WHERE id = ?",
+                [(_embedding_blob(json.loads(text)), qa_id) for qa_id, text in legacy],
+            )
+
+            # Normalized copy of each question for indexed exact lookups
+            if "normalized_question" not in columns:
+                cursor.execute("ALTER TABLE qa_pairs ADD COLUMN normalized_question TEXT")
+                cursor.execute("SELECT id, question FROM qa_pairs")
+                cursor.executemany(
+                    "UPDATE qa_pairs SET normalized_question = ? WHERE id = ?",
+                    [(_normalize_question(q), qa_id) for qa_id, q in cursor.fetchall()],
+                )
+
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_normalized_question ON qa_pairs(normalized_question)
+            """)
+
+            self._has_fts = self._init_fts(cursor)
+
+            # Rebuild stored vectors if they were created with a different
+            # scheme; the new version is recorded in the same transaction
+            cursor.execute("PRAGMA user_version")
+            if embedder is not None and cursor.fetchone()[0] != embedding_version:
+                cursor.execute("SELECT id, question FROM qa_pairs")
+                rows = cursor.fetchall()
+                vectors = embedder([question for _, question in rows]) if rows else []
+                cursor.executemany(
+                    "UPDATE qa_pairs SET embedding_blob = ? WHERE id = ?",
+                    [(_embedding_blob(vec), qa_id) for (qa_id, _), vec in zip(rows, vectors)],
+                )
+                # PRAGMA statements cannot take bound parameters
+                cursor.execute(f"PRAGMA user_version = {int(embedding_version)}")
+
+    def _init_fts(self, cursor: sqlite3.Cursor) -> bool:
+        """
+        Create the full-text index over questions and answers, kept in sync
+        with qa_pairs by triggers. Returns False if SQLite lacks FTS5.
+        """
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'qa_fts'")
+        if cursor.fetchone():
+            return True
+
+        try:
+            cursor.execute("""
+                CREATE VIRTUAL TABLE qa_fts USING fts5(
+                    question, answer,
+                    content='qa_pairs', content_rowid='id',
+                    tokenize='porter unicode61'
+                )
+            """)
+        except sqlite3.OperationalError:
+            return False
 
         cursor.execute("""
-            CREATE TABLE IF NOT EXISTS qa_pairs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                question TEXT NOT NULL,
-                answer TEXT NOT NULL,
-                source_file TEXT,
-                category TEXT,
-                embedding TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
+            CREATE TRIGGER IF NOT EXISTS qa_pairs_fts_insert AFTER INSERT ON qa_pairs BEGIN
+                INSERT INTO qa_fts (rowid, question, answer)
+                VALUES (new.id, new.question, new.answer);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS qa_pairs_fts_delete AFTER DELETE ON qa_pairs BEGIN
+                INSERT INTO qa_fts (qa_fts, rowid, question, answer)
+                VALUES ('delete', old.id, old.question, old.answer);
+            END
         """)
-
         cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_source_file ON qa_pairs(source_file)
+            CREATE TRIGGER IF NOT EXISTS qa_pairs_fts_update AFTER UPDATE OF question, answer ON qa_pairs BEGIN
+                INSERT INTO qa_fts (qa_fts, rowid, question, answer)
+                VALUES ('delete', old.id, old.question, old.answer);
+                INSERT INTO qa_fts (rowid, question, answer)
+                VALUES (new.id, new.question, new.answer);
+            END
         """)
 
-        conn.commit()
-        conn.close()
+        # Index the rows that existed before the table did
+        cursor.execute("INSERT INTO qa_fts (qa_fts) VALUES ('rebuild')")
+        return True
 
     def add_qa_pair(
         self,
@@ -57,169 +219,262 @@ class KnowledgeBase:
         answer: str,
         source_file: str,
         category: str = "",
-        embedding: list[float] | None = None,
+        embedding: list[float] | np.ndarray | None = None,
     ) -> int:
         """Add a Q&A pair to the knowledge base."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        embedding_blob = _embedding_blob(embedding)
 
-        embedding_json = json.dumps(embedding) if embedding else None
-
-        cursor.execute(
-            """
-            INSERT INTO qa_pairs (question, answer, source_file, category, embedding)
-            VALUES (?, ?, ?, ?, ?)
-        """,
-            (question, answer, source_file, category, embedding_json),
-        )
+        with self._transaction() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO qa_pairs (question, answer, source_file, category, embedding_blob, normalized_question)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """,
+                (
+                    question,
+                    answer,
+                    source_file,
+                    category,
+                    embedding_blob,
+                    _normalize_question(question),
+                ),
+            )
+            qa_id = cursor.lastrowid
 
-        qa_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+            self.version += 1
+            if embedding_blob:
+                self._append_to_index(
+                    StoredQA(qa_id, question, answer, source_file, category, embedding)
+                )
 
         return qa_id
 
     def add_qa_pairs_batch(self, qa_pairs: list[dict]) -> list[int]:
         """Add multiple Q&A pairs efficiently."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        ids = []
-        for qa in qa_pairs:
-            embedding_json = (
-                json.dumps(qa.get("embedding")) if qa.get("embedding") else None
+        rows = [
+            (
+                qa["question"],
+                qa["answer"],
+                qa.get("source_file", ""),
+                qa.get("category", ""),
+                _embedding_blob(qa.get("embedding")),
+                _normalize_question(qa["question"]),
             )
+            for qa in qa_pairs
+        ]
+        if not rows:
+            return []
 
-            cursor.execute(
+        with self._transaction() as cursor:
+            cursor.executemany(
                 """
-                INSERT INTO qa_pairs (question, answer, source_file, category, embedding)
-                VALUES (?, ?, ?, ?, ?)
+                INSERT INTO qa_pairs (question, answer, source_file, category, embedding_blob, normalized_question)
+                VALUES (?, ?, ?, ?, ?, ?)
             """,
-                (
-                    qa["question"],
-                    qa["answer"],
-                    qa.get("source_file", ""),
-                    qa.get("category", ""),
-                    embedding_json,
-                ),
+                rows,
             )
-            ids.append(cursor.lastrowid)
 
-        conn.commit()
-        conn.close()
+            # Rows inserted by one statement inside one transaction receive
+            # consecutive ids, so the last one identifies them all
+            cursor.execute("SELECT last_insert_rowid()")
+            last_id = cursor.fetchone()[0]
+            ids = list(range(last_id - len(rows) + 1, last_id + 1))
+
+            self.version += 1
+            for qa_id, row, qa in zip(ids, rows, qa_pairs):
+                if row[4]:
+                    self._append_to_index(StoredQA(qa_id, *row[:4], qa["embedding"]))
 
         return ids
 
-    def update_embedding(self, qa_id: int, embedding: list[float]):
+    def update_embedding(self, qa_id: int, embedding: list[float] | np.ndarray):
         """Update the embedding for a Q&A pair."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute(
-            """
-            UPDATE qa_pairs SET embedding = ? WHERE id = ?
-        """,
-            (json.dumps(embedding), qa_id),
-        )
-
-        conn.commit()
-        conn.close()
+        with self._transaction() as cursor:
+            cursor.execute(
+                """
+                UPDATE qa_pairs SET embedding_blob = ? WHERE id = ?
+            """,
+                (_embedding_blob(embedding), qa_id),
+            )
+            self._invalidate_index()
 
     def get_all(self) -> list[StoredQA]:
         """Get all Q&A pairs."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        cursor = self._conn.cursor()
 
         cursor.execute(
-            "SELECT id, question, answer, source_file, category, embedding FROM qa_pairs"
+            "SELECT id, question, answer, source_file, category, embedding_blob FROM qa_pairs"
         )
         rows = cursor.fetchall()
-        conn.close()
-
-        return [
-            StoredQA(
-                id=row[0],
-                question=row[1],
-                answer=row[2],
-                source_file=row[3],
-                category=row[4],
-                embedding=json.loads(row[5]) if row[5] else None,
-            )
-            for row in rows
-        ]
+
+        return [_stored_qa(row) for row in rows]
 
     def get_by_source(self, source_file: str) -> list[StoredQA]:
         """Get all Q&A pairs from a specific source file."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        cursor = self._conn.cursor()
 
         cursor.execute(
-            "SELECT id, question, answer, source_file, category, embedding FROM qa_pairs WHERE source_file = ?",
+            "SELECT id, question, answer, source_file, category, embedding_blob FROM qa_pairs WHERE source_file = ?",
             (source_file,),
         )
         rows = cursor.fetchall()
-        conn.close()
-
-        return [
-            StoredQA(
-                id=row[0],
-                question=row[1],
-                answer=row[2],
-                source_file=row[3],
-                category=row[4],
-                embedding=json.loads(row[5]) if row[5] else None,
+
+        return [_stored_qa(row) for row in rows]
+
+    def lookup_by_question(self, question: str, limit: int = 5) -> list[StoredQA]:
+        """
+        Find stored Q&A pairs by question text without embeddings.
+        Exact matches on the normalized question come first; failing those,
+        questions sharing significant words with it, ranked by full-text
+        relevance. Questions made up only of stop words have no such matches.
+        """
+        if limit <= 0:
+            return []
+
+        normalized = _normalize_question(question)
+        cursor = self._conn.cursor()
+
+        cursor.execute(
+            "SELECT id, question, answer, source_file, category, embedding_blob FROM qa_pairs WHERE normalized_question = ? LIMIT ?",
+            (normalized, limit),
+        )
+        rows = cursor.fetchall()
+        if rows:
+            return [_stored_qa(row) for row in rows]
+
+        if self._has_fts:
+            tokens = dict.fromkeys(significant_words(normalized))
+            if not tokens:
+                return []
+
+            # Each word is quoted as a literal term; any of them may match
+            terms = " OR ".join(f'"{token}"' for token in tokens)
+            cursor.execute(
+                """
+                SELECT qa_pairs.id, qa_pairs.question, qa_pairs.answer, qa_pairs.source_file,
+                       qa_pairs.category, qa_pairs.embedding_blob
+                FROM qa_fts JOIN qa_pairs ON qa_pairs.id = qa_fts.rowid
+                WHERE qa_fts MATCH ? ORDER BY rank LIMIT ?
+            """,
+                (f"question : ({terms})", limit),
+            )
+        else:
+            # Without FTS5, fall back to a substring scan
+            pattern = normalized.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            cursor.execute(
+                "SELECT id, question, answer, source_file, category, embedding_blob FROM qa_pairs WHERE normalized_question LIKE ? ESCAPE '\\' LIMIT ?",
+                (f"%{pattern}%", limit),
             )
-            for row in rows
-        ]
+
+        return [_stored_qa(row) for row in cursor.fetchall()]
 
     def search_similar(
-        self, query_embedding: list[float], top_k: int = 5
+        self, query_embedding: list[float] | np.ndarray, top_k: int = 5
     ) -> list[tuple[StoredQA, float]]:
         """
         Search for similar questions using cosine similarity.
         Returns list of (StoredQA, similarity_score) tuples.
         """
-        all_qa = self.get_all()
+        query_vec = np.asarray(query_embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query_vec)
+        if top_k <= 0 or query_norm == 0:
+            return []
 
-        # Filter to only those with embeddings
-        qa_with_embeddings = [qa for qa in all_qa if qa.embedding]
+        # Writers may grow or drop the index, so read it under their lock
+        with self._lock:
+            if self._emb_matrix is None:
+                self._build_index()
 
-        if not qa_with_embeddings:
-            return []
+            count = len(self._emb_rows)
+            if count == 0:
+                return []
 
-        # Compute cosine similarities
-        query_vec = np.array(query_embedding)
-        query_norm = np.linalg.norm(query_vec)
+            # Stored rows are unit length, so one product scaled by the
+            # query's norm yields all similarities
+            similarities = self._emb_matrix[:count] @ query_vec
+            similarities *= 1.0 / query_norm
+            rows = self._emb_rows[:count]
 
-        similarities = []
-        for qa in qa_with_embeddings:
-            qa_vec = np.array(qa.embedding)
-            qa_norm = np.linalg.norm(qa_vec)
+        # Select the top k without sorting the whole array
+        k = min(top_k, count)
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top])]
 
-            if query_norm > 0 and qa_norm > 0:
-                similarity = np.dot(query_vec, qa_vec) / (query_norm * qa_norm)
-                similarities.append((qa, float(similarity)))
+        return [(rows[i], float(similarities[i])) for i in top]
 
-        # Sort by similarity descending
-        similarities.sort(key=lambda x: x[1], reverse=True)
+    def _build_index(self):
+        """Load all stored embeddings into a normalized float32 matrix."""
+        with self._lock:
+            cursor = self._conn.cursor()
 
-        return similarities[:top_k]
+            cursor.execute(
+                "SELECT id, question, answer, source_file, category, embedding_blob FROM qa_pairs WHERE embedding_blob IS NOT NULL"
+            )
+            rows = cursor.fetchall()
+
+            if not rows:
+                # An empty index still counts as built, so searching a knowledge
+                # base without embeddings does not query it again every time
+                self._emb_matrix = np.empty((0, 0), dtype=np.float32)
+                self._emb_rows = []
+                return
+
+            # All vectors share one dimension, so the blobs concatenate into the
+            # matrix's row-major buffer
+            matrix = np.frombuffer(
+                b"".join(row[5] for row in rows), dtype=np.float32
+            ).reshape(len(rows), -1)
+            norms = np.linalg.norm(matrix, axis=1)
+
+            # Zero vectors can never be similar to anything
+            keep = norms > 0
+            self._emb_rows = [
+                StoredQA(*row[:5], embedding=vec)
+                for row, vec, k in zip(rows, matrix, keep)
+                if k
+            ]
+            self._emb_matrix = matrix[keep]
+            self._emb_matrix *= (1.0 / norms[keep])[:, None]
+
+    def _append_to_index(self, qa: StoredQA):
+        """Add a newly stored Q&A pair to the search index if it is loaded."""
+        if self._emb_matrix is None:
+            return
+
+        vec = np.asarray(qa.embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        if norm == 0:
+            return
+
+        count = len(self._emb_rows)
+        if count == len(self._emb_matrix):
+            # Grow geometrically so repeated inserts stay amortized O(1)
+            matrix = np.empty((max(2 * count, 16), vec.shape[0]), dtype=np.float32)
+            if count:
+                matrix[:count] = self._emb_matrix[:count]
+            self._emb_matrix = matrix
+
+        self._emb_matrix[count] = vec * (1.0 / norm)
+        self._emb_rows.append(qa)
+
+    def _invalidate_index(self):
+        """Drop the search index so the next search rebuilds it."""
+        self.version += 1
+        self._emb_matrix = None
+        self._emb_rows = []
 
     def get_sources(self) -> list[str]:
         """Get list of all unique source files."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        cursor = self._conn.cursor()
 
         cursor.execute("SELECT DISTINCT source_file FROM qa_pairs")
         rows = cursor.fetchall()
-        conn.close()
 
         return [row[0] for row in rows if row[0]]
 
     def get_stats(self) -> dict:
         """Get statistics about the knowledge base."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        cursor = self._conn.cursor()
 
         cursor.execute("SELECT COUNT(*) FROM qa_pairs")
         total = cursor.fetchone()[0]
@@ -227,11 +482,9 @@ class KnowledgeBase:
         cursor.execute("SELECT COUNT(DISTINCT source_file) FROM qa_pairs")
         sources = cursor.fetchone()[0]
 
-        cursor.execute("SELECT COUNT(*) FROM qa_pairs WHERE embedding IS NOT NULL")
+        cursor.execute("SELECT COUNT(*) FROM qa_pairs WHERE embedding_blob IS NOT NULL")
         with_embeddings = cursor.fetchone()[0]
 
-        conn.close()
-
         return {
             "total_qa_pairs": total,
             "source_files": sources,
@@ -240,23 +493,15 @@ class KnowledgeBase:
 
     def delete_by_source(self, source_file: str) -> int:
         """Delete all Q&A pairs from a specific source file."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute("DELETE FROM qa_pairs WHERE source_file = ?", (source_file,))
-        deleted = cursor.rowcount
-
-        conn.commit()
-        conn.close()
+        with self._transaction() as cursor:
+            cursor.execute("DELETE FROM qa_pairs WHERE source_file = ?", (source_file,))
+            deleted = cursor.rowcount
+            self._invalidate_index()
 
         return deleted
 
     def clear_all(self):
         """Delete all Q&A pairs."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute("DELETE FROM qa_pairs")
-
-        conn.commit()
-        conn.close()
+        with self._transaction() as cursor:
+            cursor.execute("DELETE FROM qa_pairs")
+            self._invalidate_index()
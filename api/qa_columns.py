@@ -0,0 +1,61 @@
+"""
+QA Columns Module
+Detects which columns of a tabular questionnaire hold questions and answers,
+and fills answers into them.
+"""
+
+import re
+from collections.abc import Iterable
+
+import pandas as pd
+
+# A header marks a question or answer column when it contains any of these
+# fragments; each list is compiled into one alternation so a header is
+# scanned once rather than once per fragment.
+QUESTION_PATTERNS = ["question", "query", "ask", "q", "requirement", "item"]
+ANSWER_PATTERNS = ["answer", "response", "reply", "a", "value", "input"]
+
+_QUESTION_RE = re.compile("|".join(map(re.escape, QUESTION_PATTERNS)))
+_ANSWER_RE = re.compile("|".join(map(re.escape, ANSWER_PATTERNS)))
+
+
+def detect_qa_columns(headers: Iterable) -> tuple[int | None, int | None]:
+    """
+    Find the question and answer columns among a row of headers, such as
+    DataFrame.columns or the values of a worksheet's first row.
+    Returns the position of the first matching header for each, or None.
+    """
+    question_idx = None
+    answer_idx = None
+
+    for idx, header in enumerate(headers):
+        if header is None:
+            continue
+        header_lower = str(header).lower()
+        if question_idx is None and _QUESTION_RE.search(header_lower):
+            question_idx = idx
+        if answer_idx is None and _ANSWER_RE.search(header_lower):
+            answer_idx = idx
+        if question_idx is not None and answer_idx is not None:
+            break
+
+    return question_idx, answer_idx
+
+
+def fill_answers(
+    df: pd.DataFrame, question_idx: int, answer_idx: int, answer_map: dict[str, dict]
+) -> pd.DataFrame:
+    """
+    Write the suggested answer into every row whose question was answered.
+    The DataFrame is modified in place and returned.
+    """
+    questions = df.iloc[:, question_idx].astype(str).str.strip()
+    matched = questions.isin(answer_map).to_numpy()
+
+    # Template answer columns are often empty and typed as float or string;
+    # hold arbitrary answer text instead
+    answers = df.iloc[:, answer_idx].astype(object).to_numpy(copy=True)
+    answers[matched] = [answer_map[q]["suggested_answer"] for q in questions[matched]]
+    df.isetitem(answer_idx, answers)
+
+    return df
@@ -0,0 +1,115 @@
+"""
+Text Tokens Module
+Splits text into the words used for embeddings and full-text lookups.
+"""
+
+import re
+
+TOKEN_RE = re.compile(r"\b\w+\b")
+
+# Common words too frequent to tell questions apart
+STOP_WORDS = frozenset(
+    {
+        "the",
+        "a",
+        "an",
+        "is",
+        "are",
+        "was",
+        "were",
+        "be",
+        "been",
+        "being",
+        "have",
+        "has",
+        "had",
+        "do",
+        "does",
+        "did",
+        "will",
+        "would",
+        "could",
+        "should",
+        "may",
+        "might",
+        "must",
+        "shall",
+        "can",
+        "need",
+        "dare",
+        "ought",
+        "used",
+        "to",
+        "of",
+        "in",
+        "for",
+        "on",
+        "with",
+        "at",
+        "by",
+        "from",
+        "as",
+        "into",
+        "through",
+        "during",
+        "before",
+        "after",
+        "above",
+        "below",
+        "between",
+        "under",
+        "again",
+        "further",
+        "then",
+        "once",
+        "and",
+        "but",
+        "or",
+        "nor",
+        "so",
+        "yet",
+        "both",
+        "either",
+        "neither",
+        "not",
+        "only",
+        "own",
+        "same",
+        "than",
+        "too",
+        "very",
+        "just",
+        "also",
+        "your",
+        "you",
+        "our",
+        "we",
+        "they",
+        "their",
+        "this",
+        "that",
+        "these",
+        "those",
+        "what",
+        "which",
+        "who",
+        "whom",
+        "how",
+        "when",
+        "where",
+        "why",
+        "all",
+        "each",
+        "every",
+        "any",
+        "some",
+        "no",
+        "none",
+    }
+)
+
+
+def significant_words(text: str) -> list[str]:
+    """Split text into lowercase words, dropping stop words and short words."""
+    words = TOKEN_RE.findall(text.lower())
+    return [w for w in words if w not in STOP_WORDS and len(w) > 2]
@@ -3,15 +3,91 @@ Answer Generator Module
 Uses Claude to generate answers based on similar Q&A pairs from knowledge base.
 """
 
-import json
-import re
+import asyncio
+import functools
+from collections import OrderedDict
 from dataclasses import dataclass
 
-from anthropic import Anthropic
+import xxhash
+from anthropic import AsyncAnthropic
 
 from knowledge_base import KnowledgeBase, StoredQA
 from embeddings import SimpleEmbeddings
 
+# Maximum number of Claude requests in flight while answering a batch
+MAX_CONCURRENT_REQUESTS = 8
+
+# Number of questions answered by a single Claude request
+QUESTIONS_PER_REQUEST = 15
+
+# Number of knowledge base lookups kept in memory
+CONTEXT_CACHE_SIZE = 1024
+
+# Number of generated answers kept in memory
+ANSWER_CACHE_SIZE = 1024
+
+
+# Fields Claude fills in for every generated answer
+_ANSWER_PROPERTIES = {
+    "answer": {
+        "type": "string",
+        "description": "The suggested answer (keep the same style/format as the source answers)",
+    },
+    "confidence": {
+        "type": "integer",
+        "description": "How confident you are, 0-100 (100 = exact match exists, 50 = related info found, 0 = guessing)",
+    },
+    "reasoning": {
+        "type": "string",
+        "description": "Brief explanation of how you derived this answer",
+    },
+    "needs_review": {
+        "type": "boolean",
+        "description": "true if a human should verify this answer, false if high confidence",
+    },
+}
+
+# Tools Claude is forced to call, so answers arrive as validated JSON input
+ANSWER_TOOL = {
+    "name": "answer",
+    "description": "Record the suggested answer to the new questionnaire question.",
+    "input_schema": {
+        "type": "object",
+        "properties": _ANSWER_PROPERTIES,
+        "required": ["answer", "confidence"],
+    },
+}
+
+ANSWERS_TOOL = {
+    "name": "answers",
+    "description": "Record the suggested answer to each numbered questionnaire question.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "answers": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "id": {"type": "integer", "description": "The question number"},
+                        **_ANSWER_PROPERTIES,
+                    },
+                    "required": ["id", "answer", "confidence"],
+                },
+            }
+        },
+        "required": ["answers"],
+    },
+}
+
+
+def _tool_input(response, tool_name: str) -> dict:
+    """Get the input Claude passed to the given tool."""
+    for block in response.content:
+        if block.type == "tool_use" and block.name == tool_name:
+            return block.input
+    raise ValueError(f"No {tool_name} tool call in response")
+
 
 @dataclass
 class GeneratedAnswer:
@@ -25,12 +101,39 @@ class GeneratedAnswer:
 
 class AnswerGenerator:
     def __init__(self, anthropic_api_key: str, knowledge_base: KnowledgeBase):
-        self.client = Anthropic(api_key=anthropic_api_key)
+        self.client = AsyncAnthropic(api_key=anthropic_api_key)
         self.kb = knowledge_base
         self.embeddings = SimpleEmbeddings()
+        self._search_context = functools.lru_cache(maxsize=CONTEXT_CACHE_SIZE)(
+            self._search_context
+        )
+        self._answer_cache: OrderedDict[str, GeneratedAnswer] = OrderedDict()
 
-    def generate_answer(self, question: str) -> GeneratedAnswer:
+    async def generate_answer_async(self, question: str) -> GeneratedAnswer:
         """Generate an answer for a question using the knowledge base."""
+        context_pairs = self._find_context(question)
+
+        # If no similar questions found, return low confidence
+        if not context_pairs:
+            return self._unanswerable(question)
+
+        key = self._answer_cache_key(question, context_pairs)
+        cached = self._get_cached_answer(key)
+        if cached:
+            return cached
+
+        # Use Claude to generate an answer
+        answer = await self._generate_with_claude(question, context_pairs)
+        self._cache_answer(key, answer)
+        return answer
+
+    def _find_context(self, question: str) -> list[dict]:
+        """Find similar Q&A pairs in the knowledge base to use as context."""
+        # Keying on the knowledge base version drops stale lookups after writes
+        return self._search_context(question, self.kb.version)
+
+    def _search_context(self, question: str, kb_version: int) -> list[dict]:
+        """Search the knowledge base for context; cached per question and version."""
         # Get embedding for the question
         query_embedding = self.embeddings.generate_embedding(question)
 
@@ -49,31 +152,74 @@ class AnswerGenerator:
                 }
             )
 
-        # If no similar questions found, return low confidence
-        if not context_pairs:
-            return GeneratedAnswer(
-                question=question,
-                suggested_answer="",
-                confidence=0,
-                needs_review=True,
-                source_questions=[],
-                reasoning="No similar questions found in knowledge base.",
-            )
+        return context_pairs
 
-        # Use Claude to generate an answer
-        return self._generate_with_claude(question, context_pairs)
+    def _answer_cache_key(self, question: str, similar_pairs: list[dict]) -> str:
+        """Fingerprint a question together with the context it is answered from."""
+        context = "".join(p["question"] + p["answer"] for p in similar_pairs)
+        return xxhash.xxh3_64_hexdigest(
+            f"{self.kb.version}|{question}|{context}".encode()
+        )
 
-    def _generate_with_claude(
-        self, question: str, similar_pairs: list[dict]
-    ) -> GeneratedAnswer:
-        """Use Claude to synthesize an answer from similar Q&A pairs."""
-        context = "\n\n".join(
+    def _get_cached_answer(self, key: str) -> GeneratedAnswer | None:
+        """Look up a previously generated answer, marking it recently used."""
+        answer = self._answer_cache.get(key)
+        if answer:
+            self._answer_cache.move_to_end(key)
+        return answer
+
+    def _cache_answer(self, key: str, answer: GeneratedAnswer):
+        """Remember a confident answer, evicting the least recently used one."""
+        # Answers flagged for review are worth regenerating next time
+        if answer.needs_review:
+            return
+
+        self._answer_cache[key] = answer
+        self._answer_cache.move_to_end(key)
+        if len(self._answer_cache) > ANSWER_CACHE_SIZE:
+            self._answer_cache.popitem(last=False)
+
+    def _unanswerable(self, question: str) -> GeneratedAnswer:
+        """Low confidence placeholder for questions without any context."""
+        return GeneratedAnswer(
+            question=question,
+            suggested_answer="",
+            confidence=0,
+            needs_review=True,
+            source_questions=[],
+            reasoning="No similar questions found in knowledge base.",
+        )
+
+    def _format_context(self, similar_pairs: list[dict]) -> str:
+        """Render similar Q&A pairs as prompt context."""
+        return "\n\n".join(
             [
                 f"Similar Question (similarity: {p['similarity']}%):\nQ: {p['question']}\nA: {p['answer']}\nSource: {p['source']}"
                 for p in similar_pairs
             ]
         )
 
+    def _answer_from_result(
+        self, question: str, result: dict, similar_pairs: list[dict]
+    ) -> GeneratedAnswer:
+        """Build a GeneratedAnswer from Claude's parsed JSON result."""
+        confidence = int(result.get("confidence", 50))
+
+        return GeneratedAnswer(
+            question=question,
+            suggested_answer=result.get("answer", ""),
+            confidence=confidence,
+            needs_review=result.get("needs_review", confidence < 70),
+            source_questions=similar_pairs,
+            reasoning=result.get("reasoning", ""),
+        )
+
+    async def _generate_with_claude(
+        self, question: str, similar_pairs: list[dict]
+    ) -> GeneratedAnswer:
+        """Use Claude to synthesize an answer from similar Q&A pairs."""
+        context = self._format_context(similar_pairs)
+
         prompt = f"""You are helping fill out a due diligence/compliance questionnaire.
 Based on the similar questions and answers from previously completed questionnaires,
 generate an appropriate answer for the new question.
@@ -84,45 +230,21 @@ Previously answered similar questions:
 New question to answer:
 {question}
 
-Provide your response as a JSON object with these fields:
-- "answer": The suggested answer (keep the same style/format as the source answers)
-- "confidence": A number 0-100 indicating how confident you are (100 = exact match exists, 50 = related info found, 0 = guessing)
-- "reasoning": Brief explanation of how you derived this answer
-- "needs_review": true if a human should verify this answer, false if high confidence
-
-Return ONLY valid JSON, no other text."""
+Record your response with the answer tool."""
 
         try:
-            response = self.client.messages.create(
+            response = await self.client.messages.create(
                 model="claude-sonnet-4-20250514",
                 max_tokens=1000,
+                tools=[ANSWER_TOOL],
+                tool_choice={"type": "tool", "name": ANSWER_TOOL["name"]},
                 messages=[{"role": "user", "content": prompt}],
             )
 
-            result_text = response.content[0].text.strip()
-
-            # Parse JSON response
-            if result_text.startswith("{"):
-                result = json.loads(result_text)
-            else:
-                match = re.search(r"\{.*\}", result_text, re.DOTALL)
-                if match:
-                    result = json.loads(match.group())
-                else:
-                    raise ValueError("No JSON found in response")
-
-            confidence = int(result.get("confidence", 50))
-
-            return GeneratedAnswer(
-                question=question,
-                suggested_answer=result.get("answer", ""),
-                confidence=confidence,
-                needs_review=result.get("needs_review", confidence < 70),
-                source_questions=similar_pairs,
-                reasoning=result.get("reasoning", ""),
-            )
+            result = _tool_input(response, ANSWER_TOOL["name"])
+            return self._answer_from_result(question, result, similar_pairs)
 
-        except (json.JSONDecodeError, ValueError, KeyError) as e:
+        except (ValueError, KeyError, TypeError) as e:
             # Fallback: use the best matching answer directly
             if similar_pairs:
                 best_match = similar_pairs[0]
@@ -144,21 +266,115 @@ Return ONLY valid JSON, no other text."""
                     reasoning=f"Error generating answer: {str(e)}",
                 )
 
-    def generate_answers_batch(self, questions: list[str]) -> list[GeneratedAnswer]:
-        """Generate answers for multiple questions."""
-        return [self.generate_answer(q) for q in questions]
+    async def _generate_batch_with_claude(
+        self, items: list[tuple[str, list[dict]]]
+    ) -> list[GeneratedAnswer]:
+        """
+        Answer several questions with a single Claude request.
+        Falls back to one request per question for any answers missing from
+        an invalid or incomplete response.
+        """
+        if len(items) == 1:
+            return [await self._generate_with_claude(*items[0])]
+
+        blocks = "\n\n".join(
+            f"Question {i}:\n{question}\n\nPreviously answered similar questions:\n{self._format_context(pairs)}"
+            for i, (question, pairs) in enumerate(items)
+        )
+
+        prompt = f"""You are helping fill out a due diligence/compliance questionnaire.
+For each numbered question below, generate an appropriate answer based on the similar
+questions and answers from previously completed questionnaires listed with it.
+
+{blocks}
+
+Record an answer for every question with the answers tool, using the question number as its id."""
+
+        answers: list[GeneratedAnswer | None] = [None] * len(items)
+
+        try:
+            response = await self.client.messages.create(
+                model="claude-sonnet-4-20250514",
+                max_tokens=1000 * len(items),
+                tools=[ANSWERS_TOOL],
+                tool_choice={"type": "tool", "name": ANSWERS_TOOL["name"]},
+                messages=[{"role": "user", "content": prompt}],
+            )
+
+            results = _tool_input(response, ANSWERS_TOOL["name"])["answers"]
+
+            for result in results:
+                i = int(result["id"])
+                if 0 <= i < len(items):
+                    question, pairs = items[i]
+                    answers[i] = self._answer_from_result(question, result, pairs)
+
+        except (ValueError, KeyError, TypeError):
+            pass
+
+        # Retry anything the batch response did not cover individually
+        missing = [i for i, answer in enumerate(answers) if answer is None]
+        retried = await asyncio.gather(
+            *(self._generate_with_claude(*items[i]) for i in missing)
+        )
+        for i, answer in zip(missing, retried):
+            answers[i] = answer
+
+        return answers
+
+    async def generate_answers_batch_async(
+        self, questions: list[str]
+    ) -> list[GeneratedAnswer]:
+        """
+        Generate answers for multiple questions.
+        Questions are grouped into multi-question Claude requests which are
+        sent concurrently.
+        """
+        answers: list[GeneratedAnswer | None] = [None] * len(questions)
+        pending = []
+
+        for i, question in enumerate(questions):
+            context_pairs = self._find_context(question)
+            if not context_pairs:
+                answers[i] = self._unanswerable(question)
+                continue
+
+            key = self._answer_cache_key(question, context_pairs)
+            answers[i] = self._get_cached_answer(key)
+            if not answers[i]:
+                pending.append((i, question, context_pairs, key))
+
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+        async def answer_chunk(chunk: list[tuple[int, str, list[dict], str]]):
+            async with semaphore:
+                generated = await self._generate_batch_with_claude(
+                    [(question, pairs) for _, question, pairs, _ in chunk]
+                )
+            for (i, _, _, key), answer in zip(chunk, generated):
+                answers[i] = answer
+                self._cache_answer(key, answer)
+
+        await asyncio.gather(
+            *(
+                answer_chunk(pending[start : start + QUESTIONS_PER_REQUEST])
+                for start in range(0, len(pending), QUESTIONS_PER_REQUEST)
+            )
+        )
+
+        return answers
 
-    def fill_questionnaire(
+    async def fill_questionnaire_async(
         self, questions: list[str]
     ) -> list[dict]:
         """
         Fill an entire questionnaire.
         Returns list of dicts with question, answer, confidence, needs_review.
         """
+        answers = await self.generate_answers_batch_async(questions)
         results = []
 
-        for question in questions:
-            answer = self.generate_answer(question)
+        for question, answer in zip(questions, answers):
             results.append(
                 {
                     "question": question,
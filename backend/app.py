@@ -2,25 +2,24 @@
 FastAPI Backend for Questionnaire Assistant
 """
 
+import functools
 import os
 import sys
 from pathlib import Path
 
+import orjson
 from dotenv import load_dotenv
 from fastapi import FastAPI, File, UploadFile, HTTPException, Form
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, Response
+from fastapi.responses import FileResponse, JSONResponse, Response
 from pydantic import BaseModel
 
 # Add parent directory to path for imports
 sys.path.insert(0, str(Path(__file__).parent))
 
-from document_parser import DocumentParser, QAPair
 from knowledge_base import KnowledgeBase
-from embeddings import SimpleEmbeddings
-from answer_generator import AnswerGenerator
-from exporter import QuestionnaireExporter
+from embeddings import EMBEDDING_VERSION, SimpleEmbeddings
 
 load_dotenv()
 
@@ -32,15 +31,58 @@ if not ANTHROPIC_API_KEY:
 DATA_DIR = Path(__file__).parent.parent / "data"
 DATA_DIR.mkdir(exist_ok=True)
 
-kb = KnowledgeBase(str(DATA_DIR / "knowledge.db"))
 embeddings = SimpleEmbeddings()
-exporter = QuestionnaireExporter()
+kb = KnowledgeBase(
+    str(DATA_DIR / "knowledge.db"),
+    embedder=embeddings.generate_embeddings_batch,
+    embedding_version=EMBEDDING_VERSION,
+)
+
+
+# The remaining components pull in the Anthropic SDK and document libraries,
+# so they are created on first use to keep cold starts of light routes fast.
+@functools.lru_cache(maxsize=1)
+def get_exporter():
+    """Get the questionnaire exporter."""
+    from exporter import QuestionnaireExporter
+
+    return QuestionnaireExporter()
+
+
+@functools.lru_cache(maxsize=1)
+def get_parser():
+    """Get the document parser, or None if the API key is not configured."""
+    if not ANTHROPIC_API_KEY:
+        return None
+
+    from document_parser import DocumentParser
+
+    return DocumentParser(ANTHROPIC_API_KEY, cache_path=str(DATA_DIR / "claude_cache.db"))
 
-# Initialize parser and generator only if API key is available
-parser = DocumentParser(ANTHROPIC_API_KEY) if ANTHROPIC_API_KEY else None
-generator = AnswerGenerator(ANTHROPIC_API_KEY, kb) if ANTHROPIC_API_KEY else None
 
-app = FastAPI(title="Questionnaire Assistant", version="1.0.0")
+@functools.lru_cache(maxsize=1)
+def get_generator():
+    """Get the answer generator, or None if the API key is not configured."""
+    if not ANTHROPIC_API_KEY:
+        return None
+
+    from answer_generator import AnswerGenerator
+
+    return AnswerGenerator(ANTHROPIC_API_KEY, kb)
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered with orjson, which also handles NumPy values."""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+app = FastAPI(
+    title="Questionnaire Assistant",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+)
 
 # Enable CORS for local development
 app.add_middleware(
@@ -102,6 +144,29 @@ async def get_stats():
 async def get_knowledge():
     """Get all Q&A pairs from knowledge base."""
     qa_pairs = kb.get_all()
+
+    # Returned directly so the whole-KB dump skips FastAPI's generic encoder
+    return ORJSONResponse(
+        {
+            "count": len(qa_pairs),
+            "pairs": [
+                {
+                    "id": qa.id,
+                    "question": qa.question,
+                    "answer": qa.answer,
+                    "source_file": qa.source_file,
+                    "category": qa.category,
+                }
+                for qa in qa_pairs
+            ],
+        }
+    )
+
+
+@app.get("/api/knowledge/lookup")
+async def lookup_knowledge(question: str, limit: int = 5):
+    """Look up stored Q&A pairs by question text."""
+    qa_pairs = kb.lookup_by_question(question, limit=limit)
     return {
         "count": len(qa_pairs),
         "pairs": [
@@ -140,18 +205,17 @@ async def add_qa_pair(qa: QAInput):
 @app.post("/api/upload-knowledge")
 async def upload_knowledge(file: UploadFile = File(...)):
     """Upload a completed questionnaire to add to knowledge base."""
+    parser = get_parser()
     if not parser:
         raise HTTPException(
             status_code=500, detail="API key not configured. Cannot parse documents."
         )
 
-    # Read file content
-    content = await file.read()
     filename = file.filename
 
-    # Parse the document
+    # Parse straight from the uploaded file rather than a copy in memory
     try:
-        qa_pairs = parser.parse_file(filename, content)
+        qa_pairs = parser.parse_file(filename, file.file)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -163,17 +227,21 @@ async def upload_knowledge(file: UploadFile = File(...)):
         )
 
     # Generate embeddings and add to knowledge base
-    added_ids = []
-    for qa in qa_pairs:
-        embedding = embeddings.generate_embedding(qa.question)
-        qa_id = kb.add_qa_pair(
-            question=qa.question,
-            answer=qa.answer,
-            source_file=qa.source_file,
-            category=qa.category,
-            embedding=embedding,
-        )
-        added_ids.append(qa_id)
+    question_embeddings = embeddings.generate_embeddings_batch(
+        [qa.question for qa in qa_pairs]
+    )
+    added_ids = kb.add_qa_pairs_batch(
+        [
+            {
+                "question": qa.question,
+                "answer": qa.answer,
+                "source_file": qa.source_file,
+                "category": qa.category,
+                "embedding": embedding,
+            }
+            for qa, embedding in zip(qa_pairs, question_embeddings)
+        ]
+    )
 
     return {
         "message": f"Successfully added {len(added_ids)} Q&A pairs from {filename}",
@@ -185,18 +253,18 @@ async def upload_knowledge(file: UploadFile = File(...)):
 @app.post("/api/fill-questionnaire")
 async def fill_questionnaire(file: UploadFile = File(...)):
     """Upload a new questionnaire and get auto-filled answers."""
+    parser = get_parser()
+    generator = get_generator()
     if not parser or not generator:
         raise HTTPException(
             status_code=500, detail="API key not configured. Cannot process documents."
         )
 
-    # Read file content
-    content = await file.read()
     filename = file.filename
 
     # Parse the document to extract questions (even if answers are empty)
     try:
-        qa_pairs = parser.parse_file(filename, content, extract_questions_only=True)
+        qa_pairs = parser.parse_file(filename, file.file, extract_questions_only=True)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -209,7 +277,7 @@ async def fill_questionnaire(file: UploadFile = File(...)):
         raise HTTPException(status_code=400, detail="No questions found in document")
 
     # Generate answers for each question
-    results = generator.fill_questionnaire(questions)
+    results = await generator.fill_questionnaire_async(questions)
 
     # Calculate summary stats
     high_confidence = sum(1 for r in results if r["confidence"] >= 80)
@@ -217,28 +285,31 @@ async def fill_questionnaire(file: UploadFile = File(...)):
     low_confidence = sum(1 for r in results if r["confidence"] < 50)
     needs_review = sum(1 for r in results if r["needs_review"])
 
-    return {
-        "filename": filename,
-        "total_questions": len(results),
-        "summary": {
-            "high_confidence": high_confidence,
-            "medium_confidence": medium_confidence,
-            "low_confidence": low_confidence,
-            "needs_review": needs_review,
-        },
-        "results": results,
-    }
+    return ORJSONResponse(
+        {
+            "filename": filename,
+            "total_questions": len(results),
+            "summary": {
+                "high_confidence": high_confidence,
+                "medium_confidence": medium_confidence,
+                "low_confidence": low_confidence,
+                "needs_review": needs_review,
+            },
+            "results": results,
+        }
+    )
 
 
 @app.post("/api/answer-question")
 async def answer_single_question(input: QuestionInput):
     """Get an answer for a single question."""
+    generator = get_generator()
     if not generator:
         raise HTTPException(
             status_code=500, detail="API key not configured. Cannot generate answers."
         )
 
-    answer = generator.generate_answer(input.question)
+    answer = await generator.generate_answer_async(input.question)
 
     return {
         "question": answer.question,
@@ -274,8 +345,8 @@ async def export_questionnaire(
 
     print(f"Export request received for file: {file.filename}")
 
-    # Read the original file
-    template_content = await file.read()
+    # Export from the uploaded file object rather than a copy in memory
+    template_content = file.file
     template_filename = file.filename
 
     # Parse the answers JSON
@@ -289,7 +360,7 @@ async def export_questionnaire(
     # Export the filled questionnaire
     try:
         print(f"Exporting to format: {Path(template_filename).suffix}")
-        content, content_type = exporter.export(
+        content, content_type = get_exporter().export(
             template_content, template_filename, filled_answers
         )
 
@@ -3,16 +3,48 @@ Document Parser Module
 Parses Excel, CSV, Word, and PDF files to extract Q&A pairs.
 """
 
+import hashlib
 import io
+import json
+import os
 import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from dataclasses import dataclass
 from pathlib import Path
+from typing import BinaryIO
 
+import numpy as np
 import pandas as pd
 from docx import Document
 from pypdf import PdfReader
 from anthropic import Anthropic
 
+from file_streams import as_stream
+from qa_columns import detect_qa_columns
+
+# PDFs with at least this many pages have their text extracted by a pool of
+# worker processes; smaller ones are not worth the process start-up cost
+PDF_PARALLEL_MIN_PAGES = 16
+
+# Each extraction worker parses its own copy of the PDF, so bound the pool
+PDF_MAX_WORKERS = 8
+
+# How long extraction results from Claude are reused for identical text
+EXTRACTION_CACHE_TTL = 30 * 24 * 3600
+
+# Longest document text sent to Claude for extraction
+MAX_EXTRACTION_CHARS = 50000
+
+# Threads used to parse sheets or files side by side
+MAX_PARSE_WORKERS = 8
+
+# Extraction calls to Claude allowed in flight at once, to stay within rate limits
+MAX_CONCURRENT_EXTRACTIONS = 5
+
 
 @dataclass
 class QAPair:
@@ -22,16 +54,163 @@ class QAPair:
     category: str = ""
 
 
+def _cell_text(column: pd.Series) -> pd.Series:
+    """Get a column as stripped strings, with missing or NaN cells as ""."""
+    text = column.astype(str).fillna("").str.strip()
+    return text.mask(text.str.lower() == "nan", "")
+
+
+# Prompts for pulling Q&A pairs out of unstructured documents. The mode-specific
+# instructions follow the document so the document prefix can be cached.
+EXTRACTION_SYSTEM_PROMPT = "You extract questions and answers from due diligence/compliance questionnaire documents."
+
+QUESTIONS_ONLY_INSTRUCTIONS = """Extract all questions from the questionnaire document above.
+This is a NEW questionnaire to be filled out, so answers may be missing or empty.
+
+Return a JSON array of objects with "question" and "answer" fields.
+For questions without answers, set "answer" to an empty string.
+Only include actual questions, not headers or instructions.
+
+Return ONLY valid JSON array, no other text. Example format:
+[{"question": "What is your company name?", "answer": ""}]"""
+
+QA_PAIRS_INSTRUCTIONS = """Extract all question-answer pairs from the questionnaire document above.
+
+Return a JSON array of objects with "question" and "answer" fields.
+Only include actual Q&A pairs, not headers or instructions.
+If a question has no answer, skip it.
+
+Return ONLY valid JSON array, no other text. Example format:
+[{"question": "What is your company name?", "answer": "Acme Corp"}]"""
+
+
+def _table_text(df: pd.DataFrame) -> str:
+    """
+    Render a sheet as CSV for Claude. Sheets too long to send whole are
+    sampled evenly across their rows, so the text covers the entire sheet
+    and never ends in a cut-off row.
+    """
+    text = df.to_csv(index=False)
+
+    rows = len(df)
+    while len(text) > MAX_EXTRACTION_CHARS and rows > 1:
+        rows = min(rows - 1, int(rows * MAX_EXTRACTION_CHARS / len(text)))
+        positions = np.linspace(0, len(df) - 1, num=max(rows, 1)).astype(int)
+        text = df.iloc[positions].to_csv(index=False)
+
+    return text
+
+
+# The PDF being extracted inside a worker process, loaded once per worker
+_worker_reader: PdfReader | None = None
+
+
+def _init_pdf_worker(content: bytes):
+    """Load the PDF in a freshly started worker process."""
+    global _worker_reader
+    _worker_reader = PdfReader(io.BytesIO(content))
+
+
+def _extract_page(page_index: int) -> str:
+    """Extract the text of one page of the worker's PDF."""
+    return _worker_reader.pages[page_index].extract_text() or ""
+
+
+def _extract_pdf_pages(reader: PdfReader, content: bytes) -> list[str]:
+    """Extract the text of every page of a PDF, in page order."""
+    page_count = len(reader.pages)
+    workers = min(os.cpu_count() or 1, PDF_MAX_WORKERS, page_count)
+
+    if page_count >= PDF_PARALLEL_MIN_PAGES and workers > 1:
+        try:
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_pdf_worker,
+                initargs=(content,),
+            ) as pool:
+                return list(
+                    pool.map(
+                        _extract_page,
+                        range(page_count),
+                        chunksize=max(1, page_count // (workers * 4)),
+                    )
+                )
+        except (OSError, NotImplementedError, BrokenProcessPool):
+            # Some serverless runtimes cannot start worker processes
+            pass
+
+    return [page.extract_text() or "" for page in reader.pages]
+
+
 class DocumentParser:
-    def __init__(self, anthropic_api_key: str):
+    def __init__(self, anthropic_api_key: str, cache_path: str | None = None):
+        """
+        Args:
+            anthropic_api_key: API key for Claude
+            cache_path: SQLite file in which to keep Claude's extraction
+                results, so re-uploading the same document skips the call.
+                Results are not cached if omitted.
+        """
         self.client = Anthropic(api_key=anthropic_api_key)
+        self.cache_path = cache_path
+        self._extraction_slots = threading.BoundedSemaphore(MAX_CONCURRENT_EXTRACTIONS)
+
+        if cache_path:
+            self._init_cache()
+
+    def _init_cache(self):
+        """Create the extraction cache table and drop expired entries."""
+        conn = sqlite3.connect(self.cache_path)
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS extractions (
+                key TEXT PRIMARY KEY,
+                pairs TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        cursor.execute(
+            "DELETE FROM extractions WHERE created_at < ?",
+            (time.time() - EXTRACTION_CACHE_TTL,),
+        )
+
+        conn.commit()
+        conn.close()
+
+    def _get_cached_extraction(self, key: str) -> list[list[str]] | None:
+        """Get the cached (question, answer) pairs for a key, if still fresh."""
+        conn = sqlite3.connect(self.cache_path)
+        cursor = conn.cursor()
+
+        cursor.execute(
+            "SELECT pairs FROM extractions WHERE key = ? AND created_at >= ?",
+            (key, time.time() - EXTRACTION_CACHE_TTL),
+        )
+        row = cursor.fetchone()
+        conn.close()
 
-    def parse_file(self, file_path: str, file_content: bytes = None, extract_questions_only: bool = False) -> list[QAPair]:
+        return json.loads(row[0]) if row else None
+
+    def _cache_extraction(self, key: str, pairs: list[list[str]]):
+        """Store the (question, answer) pairs extracted for a key."""
+        conn = sqlite3.connect(self.cache_path)
+        cursor = conn.cursor()
+
+        cursor.execute(
+            "INSERT OR REPLACE INTO extractions (key, pairs, created_at) VALUES (?, ?, ?)",
+            (key, json.dumps(pairs), time.time()),
+        )
+
+        conn.commit()
+        conn.close()
+
+    def parse_file(self, file_path: str, file_content: bytes | BinaryIO | None = None, extract_questions_only: bool = False) -> list[QAPair]:
         """Parse a file and extract Q&A pairs.
 
         Args:
             file_path: Path to the file
-            file_content: File content as bytes
+            file_content: File content as bytes or a readable binary file object
             extract_questions_only: If True, extract questions even if answers are empty
         """
         path = Path(file_path)
@@ -48,26 +227,60 @@ class DocumentParser:
         else:
             raise ValueError(f"Unsupported file format: {suffix}")
 
-    def _parse_excel(self, file_path: str, file_content: bytes = None, extract_questions_only: bool = False) -> list[QAPair]:
+    def parse_files(
+        self, files: list[tuple[str, bytes | BinaryIO]], extract_questions_only: bool = False
+    ) -> list[QAPair]:
+        """Parse several files concurrently.
+
+        Args:
+            files: (file_path, file_content) tuples, as taken by parse_file
+            extract_questions_only: If True, extract questions even if answers are empty
+
+        Returns:
+            The Q&A pairs of all files, in the order the files were given
+        """
+        if not files:
+            return []
+
+        with ThreadPoolExecutor(max_workers=min(MAX_PARSE_WORKERS, len(files))) as pool:
+            results = pool.map(
+                lambda file: self.parse_file(file[0], file[1], extract_questions_only),
+                files,
+            )
+            return [qa for pairs in results for qa in pairs]
+
+    def _parse_excel(self, file_path: str, file_content: bytes | BinaryIO | None = None, extract_questions_only: bool = False) -> list[QAPair]:
         """Parse Excel file to extract Q&A pairs."""
-        if file_content:
-            df = pd.read_excel(io.BytesIO(file_content), sheet_name=None)
+        if file_content is not None:
+            df = pd.read_excel(as_stream(file_content), sheet_name=None)
         else:
             df = pd.read_excel(file_path, sheet_name=None)
 
-        qa_pairs = []
         source_name = Path(file_path).name
 
-        for sheet_name, sheet_df in df.items():
-            pairs = self._extract_qa_from_dataframe(sheet_df, source_name, sheet_name, extract_questions_only)
-            qa_pairs.extend(pairs)
+        # Sheets are independent, and unstructured ones wait on Claude
+        if len(df) <= 1:
+            results = [
+                self._extract_qa_from_dataframe(sheet_df, source_name, sheet_name, extract_questions_only)
+                for sheet_name, sheet_df in df.items()
+            ]
+        else:
+            with ThreadPoolExecutor(max_workers=min(MAX_PARSE_WORKERS, len(df))) as pool:
+                results = list(
+                    pool.map(
+                        lambda sheet: self._extract_qa_from_dataframe(
+                            sheet[1], source_name, sheet[0], extract_questions_only
+                        ),
+                        df.items(),
+                    )
+                )
 
-        return qa_pairs
+        return [qa for pairs in results for qa in pairs]
 
-    def _parse_csv(self, file_path: str, file_content: bytes = None, extract_questions_only: bool = False) -> list[QAPair]:
+    def _parse_csv(self, file_path: str, file_content: bytes | BinaryIO | None = None, extract_questions_only: bool = False) -> list[QAPair]:
         """Parse CSV file to extract Q&A pairs."""
-        if file_content:
-            df = pd.read_csv(io.BytesIO(file_content))
+        if file_content is not None:
+            df = pd.read_csv(as_stream(file_content))
         else:
             df = pd.read_csv(file_path)
 
@@ -84,63 +297,46 @@ class DocumentParser:
         df.columns = df.columns.str.strip().str.lower()
 
         # Try to find question and answer columns
-        question_col = None
-        answer_col = None
-
-        question_patterns = ["question", "query", "ask", "q", "requirement", "item"]
-        answer_patterns = ["answer", "response", "reply", "a", "value", "input"]
-
-        for col in df.columns:
-            col_lower = str(col).lower()
-            if question_col is None:
-                for pattern in question_patterns:
-                    if pattern in col_lower:
-                        question_col = col
-                        break
-            if answer_col is None:
-                for pattern in answer_patterns:
-                    if pattern in col_lower:
-                        answer_col = col
-                        break
+        question_idx, answer_idx = detect_qa_columns(df.columns)
 
         # Extract questions (with or without answers)
-        if question_col:
-            for _, row in df.iterrows():
-                q = str(row[question_col]).strip()
-
-                # Skip empty or NaN questions
-                if not q or q.lower() == "nan":
-                    continue
-
-                # Get answer if available
-                a = ""
-                if answer_col:
-                    a = str(row[answer_col]).strip()
-                    if a.lower() == "nan":
-                        a = ""
-
-                # If extracting questions only, include even without answers
-                # If extracting Q&A pairs, require both
-                if extract_questions_only or a:
-                    qa_pairs.append(
-                        QAPair(
-                            question=q,
-                            answer=a,
-                            source_file=source_name,
-                            category=category,
-                        )
-                    )
+        if question_idx is not None:
+            questions = _cell_text(df.iloc[:, question_idx])
+
+            # Get answers if available
+            if answer_idx is not None:
+                answers = _cell_text(df.iloc[:, answer_idx])
+            else:
+                answers = pd.Series("", index=df.index)
+
+            # Skip empty or NaN questions
+            keep = questions.ne("")
+
+            # If extracting questions only, include even without answers
+            # If extracting Q&A pairs, require both
+            if not extract_questions_only:
+                keep &= answers.ne("")
+
+            qa_pairs = [
+                QAPair(
+                    question=q,
+                    answer=a,
+                    source_file=source_name,
+                    category=category,
+                )
+                for q, a in zip(questions[keep], answers[keep])
+            ]
         else:
             # Use Claude to extract Q&A pairs from unstructured data
-            text = df.to_string()
+            text = _table_text(df)
             qa_pairs = self._extract_qa_with_claude(text, source_name, category, extract_questions_only)
 
         return qa_pairs
 
-    def _parse_word(self, file_path: str, file_content: bytes = None, extract_questions_only: bool = False) -> list[QAPair]:
+    def _parse_word(self, file_path: str, file_content: bytes | BinaryIO | None = None, extract_questions_only: bool = False) -> list[QAPair]:
         """Parse Word document to extract Q&A pairs."""
-        if file_content:
-            doc = Document(io.BytesIO(file_content))
+        if file_content is not None:
+            doc = Document(as_stream(file_content))
         else:
             doc = Document(file_path)
 
@@ -149,36 +345,39 @@ class DocumentParser:
         # Extract all text from paragraphs and tables
         text_parts = []
 
+        # Paragraph and cell text is rebuilt from the XML on every access, so
+        # read and strip it once
         for para in doc.paragraphs:
-            if para.text.strip():
-                text_parts.append(para.text.strip())
+            text = para.text.strip()
+            if text:
+                text_parts.append(text)
 
         for table in doc.tables:
             for row in table.rows:
-                row_text = " | ".join(cell.text.strip() for cell in row.cells)
-                if row_text.strip():
-                    text_parts.append(row_text)
+                # Skip rows whose cells are all blank
+                cell_texts = [cell.text.strip() for cell in row.cells]
+                if any(cell_texts):
+                    text_parts.append(" | ".join(cell_texts))
 
         full_text = "\n".join(text_parts)
 
         # Use Claude to extract Q&A pairs
         return self._extract_qa_with_claude(full_text, source_name, "", extract_questions_only)
 
-    def _parse_pdf(self, file_path: str, file_content: bytes = None, extract_questions_only: bool = False) -> list[QAPair]:
+    def _parse_pdf(self, file_path: str, file_content: bytes | BinaryIO | None = None, extract_questions_only: bool = False) -> list[QAPair]:
         """Parse PDF file to extract Q&A pairs."""
-        if file_content:
-            reader = PdfReader(io.BytesIO(file_content))
+        if file_content is not None:
+            content = as_stream(file_content).read()
         else:
-            reader = PdfReader(file_path)
+            content = Path(file_path).read_bytes()
+
+        # Workers receive the raw bytes and open the PDF themselves
+        reader = PdfReader(io.BytesIO(content))
 
         source_name = Path(file_path).name
 
         # Extract all text
-        text_parts = []
-        for page in reader.pages:
-            text = page.extract_text()
-            if text:
-                text_parts.append(text)
+        text_parts = [text for text in _extract_pdf_pages(reader, content) if text]
 
         full_text = "\n".join(text_parts)
 
@@ -190,44 +389,46 @@ class DocumentParser:
     ) -> list[QAPair]:
         """Use Claude to extract Q&A pairs from unstructured text."""
         # Truncate if too long
-        if len(text) > 50000:
-            text = text[:50000] + "\n...[truncated]"
-
-        if extract_questions_only:
-            prompt = f"""Extract all questions from this due diligence/compliance questionnaire document.
-This is a NEW questionnaire to be filled out, so answers may be missing or empty.
-
-Return a JSON array of objects with "question" and "answer" fields.
-For questions without answers, set "answer" to an empty string.
-Only include actual questions, not headers or instructions.
-
-Document text:
-{text}
-
-Return ONLY valid JSON array, no other text. Example format:
-[{{"question": "What is your company name?", "answer": ""}}]"""
-        else:
-            prompt = f"""Extract all question-answer pairs from this due diligence/compliance questionnaire document.
-
-Return a JSON array of objects with "question" and "answer" fields.
-Only include actual Q&A pairs, not headers or instructions.
-If a question has no answer, skip it.
-
-Document text:
-{text}
-
-Return ONLY valid JSON array, no other text. Example format:
-[{{"question": "What is your company name?", "answer": "Acme Corp"}}]"""
-
-        response = self.client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=4000,
-            messages=[{"role": "user", "content": prompt}],
-        )
+        if len(text) > MAX_EXTRACTION_CHARS:
+            text = text[:MAX_EXTRACTION_CHARS] + "\n...[truncated]"
+
+        cache_key = None
+        if self.cache_path:
+            cache_key = hashlib.blake2b(
+                f"{extract_questions_only}|{text}".encode(), digest_size=16
+            ).hexdigest()
+            cached = self._get_cached_extraction(cache_key)
+            if cached is not None:
+                return [
+                    QAPair(question=q, answer=a, source_file=source_name, category=category)
+                    for q, a in cached
+                ]
+
+        instructions = QUESTIONS_ONLY_INSTRUCTIONS if extract_questions_only else QA_PAIRS_INSTRUCTIONS
+
+        # The document comes first and is marked as a cache breakpoint, so a
+        # second pass over the same document in the other mode reuses it
+        with self._extraction_slots:
+            response = self.client.messages.create(
+                model="claude-sonnet-4-20250514",
+                max_tokens=4000,
+                system=EXTRACTION_SYSTEM_PROMPT,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {
+                                "type": "text",
+                                "text": f"Document text:\n{text}",
+                                "cache_control": {"type": "ephemeral"},
+                            },
+                            {"type": "text", "text": instructions},
+                        ],
+                    }
+                ],
+            )
 
         try:
-            import json
-
             result_text = response.content[0].text.strip()
 
             # Try to extract JSON from response
@@ -256,6 +457,9 @@ Return ONLY valid JSON array, no other text. Example format:
                             )
                         )
 
+            if cache_key:
+                self._cache_extraction(cache_key, [[qa.question, qa.answer] for qa in qa_pairs])
+
             return qa_pairs
 
         except (json.JSONDecodeError, IndexError, KeyError):
@@ -3,97 +3,275 @@ Embeddings Module
 Generates embeddings for semantic search using Claude-based feature extraction.
 """
 
-import hashlib
-import re
-from anthropic import Anthropic
+import asyncio
+import functools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import xxhash
+
+from text_tokens import TOKEN_RE, significant_words
+
+# Bump whenever the token hashing scheme changes; vectors stored with an
+# older version are no longer comparable and must be regenerated.
+EMBEDDING_VERSION = 1
+
+# Maximum number of Claude requests in flight while embedding a batch
+MAX_CONCURRENT_REQUESTS = 8
+
+# Number of Claude-derived embeddings kept in memory by EmbeddingsGenerator
+EMBEDDING_CACHE_SIZE = 2048
+
+
+def _hash_positions(tokens: list[str], positions_per_token: int, dim: int) -> np.ndarray:
+    """Map every token to bucket positions taken from the bytes of its xxh3 digest."""
+    digests = b"".join(
+        xxhash.xxh3_64_digest(token.encode())[:positions_per_token] for token in tokens
+    )
+    return np.frombuffer(digests, dtype=np.uint8).astype(np.intp) % dim
+
+
+@functools.lru_cache(maxsize=50000)
+def _token_digest(token: str) -> bytes:
+    """Leading xxh3 digest bytes of a SimpleEmbeddings token, memoized per token."""
+    return xxhash.xxh3_64_digest(token.encode())[:4]
+
+
+def _token_positions(tokens: list[str], dim: int) -> np.ndarray:
+    """Map every token to its four bucket positions, hashing each token only once."""
+    digests = b"".join(map(_token_digest, tokens))
+    return np.frombuffer(digests, dtype=np.uint8).astype(np.intp) % dim
+
+
+def _embed_core(positions: np.ndarray, offsets: np.ndarray, dim: int) -> np.ndarray:
+    """
+    Accumulate bucket positions into L2-normalized float32 vectors.
+    positions[offsets[i]:offsets[i + 1]] are the buckets of the i-th text;
+    all texts are histogrammed together in a single bincount.
+    """
+    count = len(offsets) - 1
+    rows = np.repeat(np.arange(count, dtype=np.intp), np.diff(offsets))
+    vectors = np.bincount(rows * dim + positions, minlength=count * dim)
+    vectors = vectors.reshape(count, dim).astype(np.float32)
+
+    # Scale by reciprocal magnitudes; all-zero rows get a scale of zero
+    magnitudes = np.linalg.norm(vectors, axis=1, keepdims=True)
+    scale = np.divide(1.0, magnitudes, out=np.zeros_like(magnitudes), where=magnitudes > 0)
+    vectors *= scale
+    return vectors
+
+
+def _embed_one(positions: np.ndarray, dim: int) -> np.ndarray:
+    """Accumulate the bucket positions of a single text into a vector."""
+    return _embed_core(positions, np.array([0, len(positions)]), dim)[0]
+
+
+@functools.lru_cache(maxsize=4096)
+def _embed_cached(text: str, dim: int) -> bytes:
+    """Compute a SimpleEmbeddings vector, memoized as raw float32 bytes."""
+    # Use multiple hash positions for better distribution
+    positions = _token_positions(significant_words(text), dim)
+    return _embed_one(positions, dim).tobytes()
 
 
 class EmbeddingsGenerator:
     def __init__(self, anthropic_api_key: str):
+        # Imported here so SimpleEmbeddings users do not load the SDK
+        from anthropic import Anthropic
+
         self.client = Anthropic(api_key=anthropic_api_key)
-        self._cache = {}
+        self._api_key = anthropic_api_key
+        # LRU keyed by the raw 16-byte xxh3 digest of the text
+        self._cache: OrderedDict[bytes, np.ndarray] = OrderedDict()
 
-    def generate_embedding(self, text: str) -> list[float]:
+    def generate_embedding(self, text: str) -> np.ndarray:
         """
         Generate a semantic embedding for the given text.
         Uses Claude to extract key concepts and creates a feature vector.
+        Returns a writable float32 array owned by the caller.
         """
         # Check cache
-        cache_key = hashlib.md5(text.encode()).hexdigest()
-        if cache_key in self._cache:
-            return self._cache[cache_key]
-
-        # Use Claude to extract key concepts
-        prompt = f"""Analyze this question/text and extract 20 key semantic features as single words or short phrases.
-Focus on: topic, domain, compliance area, data type, security concept, process type.
-
-Text: {text}
-
-Return ONLY a comma-separated list of 20 features, nothing else.
-Example: data security, encryption, personal data, GDPR, access control, authentication, ..."""
+        cache_key = xxhash.xxh3_128_digest(text.encode())
+        cached = self._get_cached(cache_key)
+        if cached is not None:
+            return cached
 
         try:
-            response = self.client.messages.create(
-                model="claude-sonnet-4-20250514",
-                max_tokens=200,
-                messages=[{"role": "user", "content": prompt}],
-            )
-
-            features_text = response.content[0].text.strip()
-            features = [f.strip().lower() for f in features_text.split(",")]
+            # Use Claude to extract key concepts
+            response = self.client.messages.create(**self._feature_request(text))
+            features = self._parse_features(response)
 
             # Create a simple embedding based on feature hashes
             # This creates a consistent vector representation
             embedding = self._features_to_vector(features)
 
-            self._cache[cache_key] = embedding
+            self._put_cached(cache_key, embedding)
             return embedding
 
         except Exception:
             # Fallback to simple keyword-based embedding
             return self._simple_embedding(text)
 
-    def _features_to_vector(self, features: list[str], dim: int = 256) -> list[float]:
-        """Convert features to a fixed-dimension vector using hash-based encoding."""
-        vector = [0.0] * dim
+    def _get_cached(self, key: bytes) -> np.ndarray | None:
+        """Look up a cached embedding, marking it recently used."""
+        embedding = self._cache.get(key)
+        if embedding is None:
+            return None
+        self._cache.move_to_end(key)
+        return embedding.copy()
+
+    def _put_cached(self, key: bytes, embedding: np.ndarray):
+        """Cache a private copy of an embedding, evicting the least recently used one."""
+        self._cache[key] = embedding.copy()
+        self._cache.move_to_end(key)
+        if len(self._cache) > EMBEDDING_CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+    def _feature_request(self, text: str) -> dict:
+        """Build the Claude request that extracts semantic features from text."""
+        prompt = f"""Analyze this question/text and extract 20 key semantic features as single words or short phrases.
+Focus on: topic, domain, compliance area, data type, security concept, process type.
+
+Text: {text}
+
+Return ONLY a comma-separated list of 20 features, nothing else.
+Example: data security, encryption, personal data, GDPR, access control, authentication, ..."""
 
-        for feature in features:
-            # Hash feature to get positions
-            h = hashlib.md5(feature.encode()).hexdigest()
-            for i in range(0, min(len(h), 8), 2):
-                pos = int(h[i : i + 2], 16) % dim
-                vector[pos] += 1.0
+        return {
+            "model": "claude-sonnet-4-20250514",
+            "max_tokens": 200,
+            "messages": [{"role": "user", "content": prompt}],
+        }
 
-        # Normalize
-        magnitude = sum(v * v for v in vector) ** 0.5
-        if magnitude > 0:
-            vector = [v / magnitude for v in vector]
+    def _parse_features(self, response) -> list[str]:
+        """Split Claude's comma-separated feature list."""
+        features_text = response.content[0].text.strip()
+        return [f.strip().lower() for f in features_text.split(",")]
 
-        return vector
+    def _features_to_vector(self, features: list[str], dim: int = 256) -> np.ndarray:
+        """Convert features to a fixed-dimension vector using hash-based encoding."""
+        # Each feature contributes one count per leading digest byte
+        positions = _hash_positions(features, 4, dim)
+        return _embed_one(positions, dim)
 
-    def _simple_embedding(self, text: str, dim: int = 256) -> list[float]:
+    def _simple_embedding(self, text: str, dim: int = 256) -> np.ndarray:
         """Simple fallback embedding based on word hashing."""
         # Tokenize
-        words = re.findall(r"\b\w+\b", text.lower())
+        words = TOKEN_RE.findall(text.lower())
 
-        vector = [0.0] * dim
+        positions = _hash_positions(words, 2, dim)
+        return _embed_one(positions, dim)
 
-        for word in words:
-            h = hashlib.md5(word.encode()).hexdigest()
-            for i in range(0, 4, 2):
-                pos = int(h[i : i + 2], 16) % dim
-                vector[pos] += 1.0
+    def _extract_features(self, text: str) -> list[str] | None:
+        """Ask Claude for the features of one text, or None if the request fails."""
+        try:
+            response = self.client.messages.create(**self._feature_request(text))
+            return self._parse_features(response)
+        except Exception:
+            return None
+
+    def _lookup_batch(
+        self, texts: list[str]
+    ) -> tuple[list[bytes], dict[bytes, np.ndarray], dict[bytes, str]]:
+        """Split a batch into cache keys, cached embeddings and distinct uncached texts."""
+        keys = [xxhash.xxh3_128_digest(text.encode()) for text in texts]
+
+        # Collect results locally, as the bounded cache may evict during a batch
+        embeddings = {}
+        for key in keys:
+            cached = self._get_cached(key)
+            if cached is not None:
+                embeddings[key] = cached
+        misses = {key: text for key, text in zip(keys, texts) if key not in embeddings}
+        return keys, embeddings, misses
+
+    def _finish_batch(
+        self,
+        keys: list[bytes],
+        texts: list[str],
+        embeddings: dict[bytes, np.ndarray],
+        misses: dict[bytes, str],
+        feature_lists: list[list[str] | None],
+        dim: int,
+    ) -> list[np.ndarray]:
+        """Hash all extracted features in a single pass and assemble the batch result."""
+        extracted = [
+            (key, features)
+            for key, features in zip(misses, feature_lists)
+            if features is not None
+        ]
+        if extracted:
+            positions = _hash_positions(
+                [f for _, features in extracted for f in features], 4, dim
+            )
+            offsets = np.zeros(len(extracted) + 1, dtype=np.intp)
+            np.cumsum([4 * len(features) for _, features in extracted], out=offsets[1:])
+
+            vectors = _embed_core(positions, offsets, dim)
+            for (key, _), vector in zip(extracted, vectors):
+                embeddings[key] = vector
+                self._put_cached(key, vector)
+
+        # Texts whose feature extraction failed use the keyword fallback.
+        # Copies keep repeated texts from sharing one array.
+        return [
+            embeddings[key].copy() if key in embeddings else self._simple_embedding(text, dim)
+            for key, text in zip(keys, texts)
+        ]
+
+    def generate_embeddings_batch(
+        self, texts: list[str], dim: int = 256
+    ) -> list[np.ndarray]:
+        """
+        Generate embeddings for multiple texts.
+        Each distinct uncached text is sent to Claude from a thread pool, so
+        this is safe to call whether or not an event loop is running.
+        """
+        keys, embeddings, misses = self._lookup_batch(texts)
 
-        # Normalize
-        magnitude = sum(v * v for v in vector) ** 0.5
-        if magnitude > 0:
-            vector = [v / magnitude for v in vector]
+        feature_lists = []
+        if misses:
+            workers = min(MAX_CONCURRENT_REQUESTS, len(misses))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                feature_lists = list(pool.map(self._extract_features, misses.values()))
 
-        return vector
+        return self._finish_batch(keys, texts, embeddings, misses, feature_lists, dim)
 
-    def generate_embeddings_batch(self, texts: list[str]) -> list[list[float]]:
-        """Generate embeddings for multiple texts."""
-        return [self.generate_embedding(text) for text in texts]
+    async def generate_embeddings_batch_async(
+        self, texts: list[str], dim: int = 256
+    ) -> list[np.ndarray]:
+        """
+        Generate embeddings for multiple texts.
+        Each distinct uncached text is sent to Claude concurrently, then all
+        extracted features are hashed and accumulated in a single pass.
+        """
+        keys, embeddings, misses = self._lookup_batch(texts)
+
+        feature_lists = []
+        if misses:
+            from anthropic import AsyncAnthropic
+
+            semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+            # A client per batch keeps its connections bound to the current loop
+            async with AsyncAnthropic(api_key=self._api_key) as client:
+
+                async def extract(text: str) -> list[str] | None:
+                    async with semaphore:
+                        try:
+                            response = await client.messages.create(
+                                **self._feature_request(text)
+                            )
+                            return self._parse_features(response)
+                        except Exception:
+                            return None
+
+                feature_lists = await asyncio.gather(
+                    *(extract(t) for t in misses.values())
+                )
+
+        return self._finish_batch(keys, texts, embeddings, misses, feature_lists, dim)
 
 
 class SimpleEmbeddings:
@@ -106,123 +284,31 @@ class SimpleEmbeddings:
         self.vocab = {}
         self.idf = {}
 
-    def generate_embedding(self, text: str, dim: int = 256) -> list[float]:
-        """Generate a simple hash-based embedding."""
-        words = re.findall(r"\b\w+\b", text.lower())
-
-        # Remove common stop words
-        stop_words = {
-            "the",
-            "a",
-            "an",
-            "is",
-            "are",
-            "was",
-            "were",
-            "be",
-            "been",
-            "being",
-            "have",
-            "has",
-            "had",
-            "do",
-            "does",
-            "did",
-            "will",
-            "would",
-            "could",
-            "should",
-            "may",
-            "might",
-            "must",
-            "shall",
-            "can",
-            "need",
-            "dare",
-            "ought",
-            "used",
-            "to",
-            "of",
-            "in",
-            "for",
-            "on",
-            "with",
-            "at",
-            "by",
-            "from",
-            "as",
-            "into",
-            "through",
-            "during",
-            "before",
-            "after",
-            "above",
-            "below",
-            "between",
-            "under",
-            "again",
-            "further",
-            "then",
-            "once",
-            "and",
-            "but",
-            "or",
-            "nor",
-            "so",
-            "yet",
-            "both",
-            "either",
-            "neither",
-            "not",
-            "only",
-            "own",
-            "same",
-            "than",
-            "too",
-            "very",
-            "just",
-            "also",
-            "your",
-            "you",
-            "our",
-            "we",
-            "they",
-            "their",
-            "this",
-            "that",
-            "these",
-            "those",
-            "what",
-            "which",
-            "who",
-            "whom",
-            "how",
-            "when",
-            "where",
-            "why",
-            "all",
-            "each",
-            "every",
-            "any",
-            "some",
-            "no",
-            "none",
-        }
-
-        words = [w for w in words if w not in stop_words and len(w) > 2]
-
-        vector = [0.0] * dim
-
-        for word in words:
-            h = hashlib.md5(word.encode()).hexdigest()
-            # Use multiple hash positions for better distribution
-            for i in range(0, 8, 2):
-                pos = int(h[i : i + 2], 16) % dim
-                vector[pos] += 1.0
-
-        # Normalize
-        magnitude = sum(v * v for v in vector) ** 0.5
-        if magnitude > 0:
-            vector = [v / magnitude for v in vector]
-
-        return vector
+    def generate_embedding(self, text: str, dim: int = 256) -> np.ndarray:
+        """
+        Generate a simple hash-based embedding.
+        The vector is L2-normalized (or all zeros if no words remain), so the
+        cosine similarity of two embeddings is simply their dot product.
+        Results are cached per text; each call returns a writable float32
+        array owned by the caller.
+        """
+        return np.frombuffer(_embed_cached(text, dim), dtype=np.float32).copy()
+
+    def generate_embeddings_batch(
+        self, texts: list[str], dim: int = 256
+    ) -> list[np.ndarray]:
+        """Generate embeddings for multiple texts, hashing each distinct word once."""
+        tokenized = [significant_words(text) for text in texts]
+
+        vocabulary = list({word for words in tokenized for word in words})
+        word_index = {word: i for i, word in enumerate(vocabulary)}
+        word_positions = _token_positions(vocabulary, dim).reshape(-1, 4)
+
+        # Gather every text's word positions into one flat array
+        rows = np.fromiter(
+            (word_index[w] for words in tokenized for w in words), dtype=np.intp
+        )
+        offsets = np.zeros(len(tokenized) + 1, dtype=np.intp)
+        np.cumsum([4 * len(words) for words in tokenized], out=offsets[1:])
+
+        return list(_embed_core(word_positions[rows].ravel(), offsets, dim))
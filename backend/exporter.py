@@ -3,8 +3,11 @@ Exporter Module
 Exports filled questionnaires back to their original format.
 """
 
+import bisect
 import io
+import itertools
 from pathlib import Path
+from typing import BinaryIO
 
 import pandas as pd
 from docx import Document
@@ -12,6 +15,53 @@ from docx.shared import RGBColor
 from openpyxl import load_workbook
 from openpyxl.styles import PatternFill
 
+from file_streams import as_stream
+from qa_columns import detect_qa_columns, fill_answers
+
+
+def _joined(texts: list[str]) -> tuple[str, list[int]]:
+    """Join texts with NUL separators and return the start offset of each."""
+    starts = list(itertools.accumulate((len(text) + 1 for text in texts[:-1]), initial=0))
+    return "\0".join(texts), starts
+
+
+def _first_partial_matches(texts: list[str], keys: list[str]) -> list[int | None]:
+    """
+    For each text, find the first key (in order) that it contains or that
+    contains it. Each side is joined into one string so every key and every
+    text costs one C-level scan, instead of comparing every pair in Python.
+    """
+    matches: list[int | None] = [None] * len(texts)
+    if not texts or not keys:
+        return matches
+
+    # Keys contained in a text: look for each key across all texts
+    text_hay, text_starts = _joined(texts)
+    for key_idx, key in enumerate(keys):
+        if not key:
+            continue
+        pos = text_hay.find(key)
+        while pos >= 0:
+            text_idx = bisect.bisect_right(text_starts, pos) - 1
+            if matches[text_idx] is None:
+                matches[text_idx] = key_idx
+            if text_idx + 1 == len(texts):
+                break
+            pos = text_hay.find(key, text_starts[text_idx + 1])
+
+    # Texts contained in a key: the earliest hit lies in the first such key
+    key_hay, key_starts = _joined(keys)
+    for text_idx, text in enumerate(texts):
+        if not text:
+            continue
+        pos = key_hay.find(text)
+        if pos >= 0:
+            key_idx = bisect.bisect_right(key_starts, pos) - 1
+            if matches[text_idx] is None or key_idx < matches[text_idx]:
+                matches[text_idx] = key_idx
+
+    return matches
+
 
 class QuestionnaireExporter:
     def __init__(self):
@@ -19,7 +69,7 @@ class QuestionnaireExporter:
 
     def export_to_excel(
         self,
-        template_content: bytes,
+        template_content: bytes | BinaryIO,
         template_filename: str,
         filled_answers: list[dict],
     ) -> bytes:
@@ -27,92 +77,63 @@ class QuestionnaireExporter:
         Export filled answers to Excel format.
 
         Args:
-            template_content: Original Excel file content
+            template_content: Original Excel file content or file object
             template_filename: Original filename
             filled_answers: List of {question, answer, confidence, needs_review}
 
         Returns:
             Filled Excel file as bytes
         """
-        # Load the original Excel file
-        df_dict = pd.read_excel(io.BytesIO(template_content), sheet_name=None)
+        # Edit the original workbook in place so its formatting survives,
+        # including bold or colored runs inside cell text
+        workbook = load_workbook(as_stream(template_content), rich_text=True)
 
         # Create a mapping of questions to answers
         answer_map = {qa["question"]: qa for qa in filled_answers}
 
-        output = io.BytesIO()
+        # Yellow fill for low confidence, orange for medium
+        yellow_fill = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
+        orange_fill = PatternFill(start_color="FFD580", end_color="FFD580", fill_type="solid")
+
+        for worksheet in workbook.worksheets:
+            # Find question and answer columns from the header row
+            headers = [cell.value for cell in worksheet[1]]
+            question_idx, answer_idx = detect_qa_columns(headers)
+            if question_idx is None or answer_idx is None:
+                continue
+
+            # Fill in answers and highlight the ones that need review
+            for row in worksheet.iter_rows(min_row=2):
+                question_value = row[question_idx].value
+                if question_value is None:
+                    continue
 
-        # Write to Excel with openpyxl for styling
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            for sheet_name, df in df_dict.items():
-                # Clean column names
-                df.columns = df.columns.str.strip()
-
-                # Find question and answer columns
-                question_col = None
-                answer_col = None
-
-                question_patterns = ["question", "query", "ask", "q", "requirement", "item"]
-                answer_patterns = ["answer", "response", "reply", "a", "value", "input"]
-
-                for col in df.columns:
-                    col_lower = str(col).lower()
-                    if question_col is None:
-                        for pattern in question_patterns:
-                            if pattern in col_lower:
-                                question_col = col
-                                break
-                    if answer_col is None:
-                        for pattern in answer_patterns:
-                            if pattern in col_lower:
-                                answer_col = col
-                                break
-
-                # Fill in answers
-                if question_col and answer_col:
-                    for idx, row in df.iterrows():
-                        question = str(row[question_col]).strip()
-                        if question in answer_map:
-                            df.at[idx, answer_col] = answer_map[question]["suggested_answer"]
-
-                # Write sheet
-                df.to_excel(writer, sheet_name=sheet_name, index=False)
-
-                # Apply highlighting for low confidence answers
-                worksheet = writer.sheets[sheet_name]
-
-                if question_col and answer_col:
-                    # Find column indices
-                    question_col_idx = list(df.columns).index(question_col) + 1
-                    answer_col_idx = list(df.columns).index(answer_col) + 1
-
-                    # Yellow fill for low confidence
-                    yellow_fill = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
-                    orange_fill = PatternFill(start_color="FFD580", end_color="FFD580", fill_type="solid")
-
-                    for idx, row in df.iterrows():
-                        question = str(row[question_col]).strip()
-                        if question in answer_map:
-                            qa = answer_map[question]
-                            row_num = idx + 2  # +2 for header and 0-indexing
-
-                            if qa["confidence"] < 50:
-                                worksheet.cell(row=row_num, column=answer_col_idx).fill = yellow_fill
-                            elif qa["confidence"] < 80:
-                                worksheet.cell(row=row_num, column=answer_col_idx).fill = orange_fill
+                qa = answer_map.get(str(question_value).strip())
+                if qa is None:
+                    continue
 
+                answer_cell = row[answer_idx]
+                answer_cell.value = qa["suggested_answer"]
+
+                if qa["confidence"] < 50:
+                    answer_cell.fill = yellow_fill
+                elif qa["confidence"] < 80:
+                    answer_cell.fill = orange_fill
+
+        output = io.BytesIO()
+        workbook.save(output)
         output.seek(0)
         return output.read()
 
     def export_to_csv(
         self,
-        template_content: bytes,
+        template_content: bytes | BinaryIO,
         template_filename: str,
         filled_answers: list[dict],
     ) -> bytes:
         """Export filled answers to CSV format."""
         # Load the original CSV
-        df = pd.read_csv(io.BytesIO(template_content))
+        df = pd.read_csv(as_stream(template_content))
 
         # Create a mapping of questions to answers
         answer_map = {qa["question"]: qa for qa in filled_answers}
@@ -121,31 +142,11 @@ class QuestionnaireExporter:
         df.columns = df.columns.str.strip()
 
         # Find question and answer columns
-        question_col = None
-        answer_col = None
-
-        question_patterns = ["question", "query", "ask", "q", "requirement", "item"]
-        answer_patterns = ["answer", "response", "reply", "a", "value", "input"]
-
-        for col in df.columns:
-            col_lower = str(col).lower()
-            if question_col is None:
-                for pattern in question_patterns:
-                    if pattern in col_lower:
-                        question_col = col
-                        break
-            if answer_col is None:
-                for pattern in answer_patterns:
-                    if pattern in col_lower:
-                        answer_col = col
-                        break
+        question_idx, answer_idx = detect_qa_columns(df.columns)
 
         # Fill in answers
-        if question_col and answer_col:
-            for idx, row in df.iterrows():
-                question = str(row[question_col]).strip()
-                if question in answer_map:
-                    df.at[idx, answer_col] = answer_map[question]["suggested_answer"]
+        if question_idx is not None and answer_idx is not None:
+            fill_answers(df, question_idx, answer_idx, answer_map)
 
         # Convert to CSV
         output = io.BytesIO()
@@ -155,13 +156,13 @@ class QuestionnaireExporter:
 
     def export_to_word(
         self,
-        template_content: bytes,
+        template_content: bytes | BinaryIO,
         template_filename: str,
         filled_answers: list[dict],
     ) -> bytes:
         """Export filled answers to Word format."""
         # Load the original Word document
-        doc = Document(io.BytesIO(template_content))
+        doc = Document(as_stream(template_content))
 
         # Create a mapping of questions to answers (with normalized keys)
         answer_map = {}
@@ -170,37 +171,39 @@ class QuestionnaireExporter:
             normalized_q = qa["question"].strip().lower()
             answer_map[normalized_q] = qa
 
-        # Try to find and fill in tables
+        # Collect table rows with a question in the first cell
+        rows = []
         for table in doc.tables:
             for row in table.rows:
                 cells = row.cells
                 if len(cells) >= 2:
-                    # Get question from first cell
-                    question = cells[0].text.strip()
-                    normalized_question = question.lower()
-
-                    # Try exact match first, then partial match
-                    matched_qa = None
-                    if normalized_question in answer_map:
-                        matched_qa = answer_map[normalized_question]
-                    else:
-                        # Try partial matching
-                        for key, qa in answer_map.items():
-                            if key in normalized_question or normalized_question in key:
-                                matched_qa = qa
-                                break
-
-                    if matched_qa and matched_qa["suggested_answer"]:
-                        # Clear existing content and add new answer
-                        cells[1].text = ""  # Clear first
-                        paragraph = cells[1].paragraphs[0] if cells[1].paragraphs else cells[1].add_paragraph()
-                        run = paragraph.add_run(matched_qa["suggested_answer"])
-
-                        # Highlight based on confidence
-                        if matched_qa["confidence"] < 50:
-                            run.font.highlight_color = 7  # Yellow
-                        elif matched_qa["confidence"] < 80:
-                            run.font.color.rgb = RGBColor(255, 165, 0)  # Orange
+                    normalized_question = cells[0].text.strip().lower()
+                    if normalized_question:
+                        rows.append((cells, normalized_question))
+
+        # Try exact match first, then partial match for the rest
+        matched = [answer_map.get(question) for _, question in rows]
+        unmatched = [i for i, qa in enumerate(matched) if qa is None]
+
+        keys = list(answer_map)
+        partial = _first_partial_matches([rows[i][1] for i in unmatched], keys)
+        for i, key_idx in zip(unmatched, partial):
+            if key_idx is not None:
+                matched[i] = answer_map[keys[key_idx]]
+
+        # Fill in the matched answers
+        for (cells, _), matched_qa in zip(rows, matched):
+            if matched_qa and matched_qa["suggested_answer"]:
+                # Clear existing content and add new answer
+                cells[1].text = ""  # Clear first
+                paragraph = cells[1].paragraphs[0] if cells[1].paragraphs else cells[1].add_paragraph()
+                run = paragraph.add_run(matched_qa["suggested_answer"])
+
+                # Highlight based on confidence
+                if matched_qa["confidence"] < 50:
+                    run.font.highlight_color = 7  # Yellow
+                elif matched_qa["confidence"] < 80:
+                    run.font.color.rgb = RGBColor(255, 165, 0)  # Orange
 
         # Save to bytes
         output = io.BytesIO()
@@ -210,7 +213,7 @@ class QuestionnaireExporter:
 
     def export(
         self,
-        template_content: bytes,
+        template_content: bytes | BinaryIO,
         template_filename: str,
         filled_answers: list[dict],
     ) -> tuple[bytes, str]:
@@ -0,0 +1,15 @@
+"""
+File Streams Module
+Normalizes uploaded file content for the parsers and exporters.
+"""
+
+import io
+from typing import BinaryIO
+
+
+def as_stream(content: bytes | BinaryIO) -> BinaryIO:
+    """Wrap raw bytes in a stream; rewind file objects so they are read in full."""
+    if isinstance(content, bytes):
+        return io.BytesIO(content)
+    content.seek(0)
+    return content